@@ -1,6 +1,7 @@
-from .core.parser import fpdsRequest, fpdsXML
+from .core.parser import clear_cache, fpdsRequest, fpdsXML
 
 __all__ = [
+    "clear_cache",
     "fpdsRequest",
     "fpdsXML",
 ]
@@ -78,7 +78,8 @@ def parse(params, output):
     params_kwargs = dict(params)
     click.echo(f"Params to be used for FPDS search: {params_kwargs}")
 
-    request = fpdsRequest(**params_kwargs, cli_run=True)
+    # a CLI run is a one-off query, so responses aren't worth caching
+    request = fpdsRequest(**params_kwargs, cli_run=True, cache=False)
     click.echo("Retrieving FPDS records from ATOM feed...")
     records = request()
 
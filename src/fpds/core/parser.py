@@ -5,104 +5,88 @@ author: derek663@gmail.com
 last_updated: 01/02/2023
 """
 
-import re
-import xml
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
+from io import BytesIO
 from itertools import chain
-from typing import Dict, Iterator, List, Optional, Union
-from xml.etree import ElementTree
-from xml.etree.ElementTree import Element
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, quote_plus, urlparse
 
 import requests
+from lxml import etree
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 
 from fpds.config import FPDS_FIELDS_CONFIG as FIELDS
-from fpds.utilities import filter_config_dict, raw_literal_regex_match
+from fpds.utilities.params import raw_literal_regex_compile
 
 # types
-TREE = xml.etree.ElementTree.Element
+TREE = etree._Element
 
-NAMESPACE_REGEX = r"\{(.*)\}"
 WHITESPACE_REGEX = r"\n\s+"
-LAST_PAGE_REGEX = r"start=(.*?)$"
 
+# FPDS records are returned as Atom `entry` elements
+ATOM_NAMESPACE = "http://www.w3.org/2005/Atom"
 
-class fpdsMixin:
-    @property
-    def url_base(self) -> str:
-        return "https://www.fpds.gov/ezsearch/FEEDS/ATOM?FEEDNAME=PUBLIC"
+# field configurations keyed by name, each with its regex compiled once
+_FIELDS_BY_NAME = {
+    field["name"]: {**field, "_re": raw_literal_regex_compile(field["regex"])}
+    for field in FIELDS
+}
 
-    @staticmethod
-    def convert_to_lxml_tree(content):
-        """Returns lxml tree element from a bytes response"""
-        tree = ElementTree.fromstring(content)
-        return tree
+# upper bound on pagination requests that are in flight at the same time
+MAX_CONCURRENT_REQUESTS = 10
 
+# a single session is shared by every request so that pagination reuses
+# connections to the Atom feed; the pool is sized for concurrent page fetches
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_maxsize=MAX_CONCURRENT_REQUESTS))
+# Atom XML compresses well; responses are decompressed transparently
+_SESSION.headers["Accept-Encoding"] = "gzip, deflate"
 
-class _ElementAttributes(Element):
-    """
-    Utility class that helps parse out extra features of XML tags generated
-    by `xml.etree.ElementTree.Element`. This class should ideally not be
-    instantiated by users.
 
-    Parameters
-    ----------
-    element: xml.etree.ElementTree.Element
-        An XML element
-    namespace_dict: Dict[str, str]
-        A namespace dictionary that allows module to parse FPDS elements
-    """
+def _get_content(url: str) -> bytes:
+    """Returns the raw content of an Atom feed page. Failed requests raise"""
+    response = _SESSION.get(url)
+    response.raise_for_status()
+    return response.content
 
-    def __init__(self, element: Element, namespace_dict: Dict[str, str]) -> None:
-        self.element = element
-        self.namespace_dict = namespace_dict
 
-    def __str__(self) -> str:
-        return f"<_ElementAttributes {self.element.tag}>"
+# responses cached by URL, least recently used first out, so repeated queries
+# within the same process aren't downloaded again. Failed requests raise and
+# are not cached
+_get_cached_content = lru_cache(maxsize=256)(_get_content)
 
-    @property
-    def clean_tag(self) -> str:
-        """Tag name without the namespace. A tag like the following:
-        `ns1:productOrServiceInformation` would simply return
-        `productOrServiceInformation`
-        """
-        namespaces = "|".join(self.namespace_dict.values())
-        # yeah, f-strings don't do well with backslashes
-        PATTERN = r"\{(" + namespaces + r")\}"  # noqa
-        clean_tag = re.sub(PATTERN, "", self.element.tag)
-        return clean_tag
 
-    def _generate_nested_attribute_dict(self) -> Dict[str, str]:
-        """Returns all attributes of an Element
+def clear_cache() -> None:
+    """Clears all cached Atom feed responses.
 
-        Example
-        -------
-        <ns1:contractActionType description="BPA" part8OrPart13="PART8">E</ns1:contractActionType>
+    Responses are cached by URL for the lifetime of the process. A
+    long-running process that re-runs a query whose results may have changed
+    since (e.g. a `LAST_MOD_DATE` range that includes today) should clear the
+    cache first, or create the request with `fpdsRequest(..., cache=False)`.
+    """
+    _get_cached_content.cache_clear()
 
-        Extracting the text value from `contractActionType` would return "E".
-        Addtional metadata is stored as tag attributes which this method will
-        help parse out. This method will generate a dictionary including both
-        the text and tag attribute data. In this example, `contractActionType`
-        has two attributes: `description` and `part8OrPart13`. This method will
-        represent this tag the following way:
 
-            {
-                "contractActionType": "E",
-                "contractActionType__description": "BPA"
-                "contractActionType__part8OrPart13": "PART8"
-            }
-        """
-        attributes = self.element.attrib
-        _attributes_copy = attributes.copy()
+# a single parser is reused for every response; ID collection, DTD loading
+# and entity resolution aren't needed for the Atom feed and network access is
+# disabled. Streamed responses (see `fpdsXML.iter_entries`) use the same options
+_PARSER = etree.XMLParser(
+    collect_ids=False, resolve_entities=False, no_network=True, load_dtd=False
+)
+
 
-        tag = self.clean_tag
-        # the undecoded, textual value of the element
-        if self.element.text:
-            _attributes_copy[f"{tag}"] = self.element.text
-        for key in attributes:
-            nested_key = f"{tag}__{key}"
-            _attributes_copy[nested_key] = attributes[key]
-            del _attributes_copy[key]
-        return _attributes_copy
+class fpdsMixin:
+    @property
+    def url_base(self) -> str:
+        return "https://www.fpds.gov/ezsearch/FEEDS/ATOM?FEEDNAME=PUBLIC"
+
+    @staticmethod
+    def convert_to_lxml_tree(content):
+        """Returns lxml tree element from a bytes response"""
+        tree = etree.fromstring(content, _PARSER)
+        return tree
 
 
 class fpdsRequest(fpdsMixin):
@@ -122,6 +106,10 @@ class fpdsRequest(fpdsMixin):
     cli_run: bool
         Flag indicating if this class is being isntantiated by a CLI run
         Defaults to `False`
+    cache: bool
+        Flag indicating if responses should be read from and stored in the
+        in-process response cache. See `fpds.clear_cache`
+        Defaults to `True`
 
     Raises
     ------
@@ -131,9 +119,10 @@ class fpdsRequest(fpdsMixin):
         does not match the expected regex.
     """
 
-    def __init__(self, cli_run: bool = False, **kwargs):
+    def __init__(self, cli_run: bool = False, cache: bool = True, **kwargs):
         self.cli_run = cli_run
-        self.content = []  # type: List[TREE]
+        self.cache = cache
+        self.content = []  # type: List[bytes]
         if kwargs:
             self.kwargs = kwargs
         else:
@@ -141,14 +130,14 @@ class fpdsRequest(fpdsMixin):
 
         # do not run class validations since CLI command has its own
         if not self.cli_run:
-            self.valid_fields = [field.get("name") for field in FIELDS]
+            self.valid_fields = list(_FIELDS_BY_NAME)
             for kwarg, value in self.kwargs.items():
-                if kwarg not in self.valid_fields:
+                if kwarg not in _FIELDS_BY_NAME:
                     raise ValueError(f"`{kwarg}` is not a valid FPDS parameter")
                 else:
-                    kwarg_dict = filter_config_dict(FIELDS, "name", kwarg)
+                    kwarg_dict = _FIELDS_BY_NAME[kwarg]
                     kwarg_regex = kwarg_dict.get("regex")
-                    match = raw_literal_regex_match(kwarg_regex, value)
+                    match = kwarg_dict["_re"].match(value)
                     if not match:
                         raise ValueError(
                             f"`{value}` does not match regex: {kwarg_regex}"
@@ -161,7 +150,7 @@ class fpdsRequest(fpdsMixin):
         return f"<fpdsRequest {kwargs_str}>"
 
     def __call__(self):
-        records = self.parse_content()
+        records = list(self.parse_content())
         return records
 
     @property
@@ -170,8 +159,9 @@ class fpdsRequest(fpdsMixin):
         _params = [f"{key}:{value}" for key, value in self.kwargs.items()]
         return " ".join(_params)
 
-    def send_request(self, url: Optional[str] = None):
-        """Sends request to FPDS Atom feed
+    def send_request(self, url: Optional[str] = None) -> bytes:
+        """Sends request to FPDS Atom feed and returns the raw response
+        content. Parsing is deferred to `fpdsXML.iter_entries`
 
         Parameters
         ----------
@@ -179,121 +169,132 @@ class fpdsRequest(fpdsMixin):
             A URL to send a GET request to. If not provided, this method
             will default to using `url_base`
         """
-        response = requests.get(
-            url=self.url_base if not url else url, params={"q": self.search_params}
-        )
-        response.raise_for_status()
-        content_tree = self.convert_to_lxml_tree(response.content)
-        self.content.append(content_tree)
-
-    def create_content_iterable(self):
-        """Paginates through response and creates an iterable of XML trees.
-        This method will not have a return but rather, will set the `content`
-        attribute to an iterable of XML ElementTree's
+        # pagination links already carry the encoded search parameters
+        if not url:
+            url = f"{self.url_base}&q={quote_plus(self.search_params)}"
+        if self.cache:
+            return _get_cached_content(url)
+        return _get_content(url)
+
+    def _send_initial_request(self) -> Tuple["fpdsXML", List[str]]:
+        """Requests the first page on its own to determine the total record
+        count. Returns the first page's `fpdsXML`, whose tree was parsed for
+        pagination and is reused when its records are parsed, and the links
+        of the remaining pages
         """
-        self.send_request()
         params = self.search_params
-        tree = fpdsXML(self.content[0])
-
-        links = tree.pagination_links(params=params)
-        if len(links) > 1:
-            links.pop(0)
-            for link in links:
-                self.send_request(link)
+        xml = fpdsXML(self.send_request())
+        links = xml.pagination_links(params=params)
+        return xml, links[1:]
+
+    def _send_pagination_requests(self, links: List[str]) -> Iterator[bytes]:
+        """Requests the remaining pages concurrently, with at most
+        `MAX_CONCURRENT_REQUESTS` in flight. Pages are yielded in page order,
+        each as soon as it has arrived, so that the consumer can parse it while
+        later pages are still downloading
+        """
+        if links:
+            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as pool:
+                yield from pool.map(self.send_request, links)
 
-    def parse_content(self) -> List[Dict[str, Union[str, int, float]]]:
-        """Parses a content iterable and generates a list of records"""
-        self.create_content_iterable()
-        records = []
-        for tree in tqdm(self.content):
-            xml = fpdsXML(tree)
-            records.append(xml.get_entry_data())
-        return list(chain.from_iterable(records))
+    def create_content_iterable(self):
+        """Paginates through response and creates an iterable of response
+        content. This method will not have a return but rather, will set the
+        `content` attribute to an iterable of bytes responses
+        """
+        xml, links = self._send_initial_request()
+        assert xml.content is not None
+        self.content = [xml.content]
+        self.content.extend(self._send_pagination_requests(links))
+
+    def parse_content(self) -> Iterator[Dict[str, str]]:
+        """Parses response content and yields records one page at a time.
+        Pages are parsed as they arrive rather than after all of them have
+        been downloaded, and aren't retained once parsed; use
+        `create_content_iterable` to populate the `content` attribute
+        """
+        # `xml` is rebound per page, so the first page's tree isn't held onto
+        xml, links = self._send_initial_request()
+        pages = chain(
+            [xml],
+            (fpdsXML(page) for page in self._send_pagination_requests(links)),
+        )
+        for xml in tqdm(pages, total=len(links) + 1):
+            yield from xml.get_entry_data()
 
 
 class fpdsXML(fpdsMixin):
-    """Parses FPDS request content received as bytes or `xml.etree.ElementTree`
+    """Parses FPDS request content received as bytes or `lxml.etree._Element`
 
     Parameters
     ----------
     content: Union[bytes, TREE]
-        Bytes content or an ElementTree element that can be parsed into
+        Bytes content or an lxml element that can be parsed into
         valid XML.
 
     Raises
     ------
     TypeError:
         If `content` is not of type `bytes` or an instance of
-        `xml.etree.ElementTree.Element`.
+        `lxml.etree._Element`.
     """
 
     def __init__(self, content: Union[bytes, TREE]) -> None:
         if isinstance(content, bytes):
-            self.content = content
-            self.tree = self.convert_to_lxml_tree()
-        if isinstance(content, TREE):
+            self.content = content  # type: Optional[bytes]
+        elif isinstance(content, TREE):
+            self.content = None
             self.tree = content
-        if not isinstance(content, (bytes, TREE)):
+        else:
             raise TypeError(
                 "You must provide bytes content or an instance of "
-                "`xml.etree.ElementTree.Element`"
+                "`lxml.etree._Element`"
             )
 
-    def parse_items(self, element: Element) -> Iterator[TREE]:
-        """Returns iteration of `Element` as a generator"""
-        yield from element.iter()
+    @cached_property
+    def tree(self) -> TREE:
+        """The full XML tree. Only parsed from bytes content when a method
+        needs to query the whole document, e.g. `total_record_count`
+        """
+        return self.convert_to_lxml_tree()
 
     def convert_to_lxml_tree(self) -> TREE:  # type: ignore
         """Returns lxml tree element from a bytes response"""
-        tree = ElementTree.fromstring(self.content)
+        tree = etree.fromstring(self.content, _PARSER)  # type: ignore
         return tree
 
-    @staticmethod
-    def _get_full_namespace(element: Element) -> str:
-        """For some odd reason, the lxml API doesn't have a method to provide
-        namespaces natively unless an XML file is saved locally. To avoid this,
-        we just do some regex work
-
-        Parameters
-        ----------
-        element: Element
-            An lxml Element type
-        """
-        namespace = re.match(NAMESPACE_REGEX, element.tag)
-        return namespace.group(1) if namespace else ""
-
     @property
     def response_size(self) -> int:
         """Max number of records in a single response"""
         return 10
 
-    @property
+    @cached_property
     def namespace_dict(self) -> Dict[str, str]:
         """The better way of parsing tree elements with namespaces, per the docs.
-        Note that `namespaces` is a list, which retains parsing order of the
-        tree, which will be important in identifying Atom entries in `fpds`
+        FPDS Atom responses declare every namespace on the root `feed` element,
+        so they are read from the root's namespace map. The namespace of the
+        root element itself is always `ns0`, regardless of declaration order,
+        which will be important in identifying Atom entries in `fpds`
 
         https://docs.python.org/3/library/xml.etree.elementtree.html#parsing-xml-with-namespaces
-        """
-        namespaces = list()
-        for element in self.parse_items(self.tree):
-            _namespace = self._get_full_namespace(element)
-            if _namespace not in namespaces:
-                namespaces.append(_namespace)
 
+        The dictionary is built once per document; subsequent accesses return
+        the cached value.
+        """
+        root_namespace = etree.QName(self.tree).namespace or ""
+        namespaces = [root_namespace] + [
+            ns for ns in self.tree.nsmap.values() if ns != root_namespace
+        ]
         namespace_dict = {f"ns{idx}": ns for idx, ns in enumerate(namespaces)}
         return namespace_dict
 
-    @property
+    @cached_property
     def total_record_count(self) -> int:
         """Total number of records across all pagination links."""
-        links = self.tree.findall(".//ns0:link", self.namespace_dict)
-        last_link = [link for link in links if link.get("rel") == "last"]
-        if last_link:
-            # length of last_link should always be 1
-            match = re.search(LAST_PAGE_REGEX, last_link[0].attrib["href"])
-            assert match is not None
-            record_count = int(match.group(1))
+        last_link = self.tree.find('.//ns0:link[@rel="last"]', self.namespace_dict)
+        if last_link is not None:
+            query = parse_qs(urlparse(last_link.attrib["href"]).query)
+            record_count = int(query["start"][0])
         else:
             record_count = len(self.get_atom_feed_entries())
         return record_count
@@ -303,32 +304,82 @@ class fpdsXML(fpdsMixin):
         total record count value
         """
         resp_size = self.response_size
-        offset = 0 if self.total_record_count <= 10 else resp_size
-        page_range = list(range(0, self.total_record_count + offset, resp_size))
-        page_links = []
-        for num in page_range:
-            link = f"{self.url_base}&q={params}&start={num}"
-            page_links.append(link)
-        return page_links
+        total = self.total_record_count
+        offset = 0 if total <= 10 else resp_size
+        prefix = f"{self.url_base}&q={quote_plus(params)}&start="
+        return [prefix + str(num) for num in range(0, total + offset, resp_size)]
 
     def get_atom_feed_entries(self) -> List[TREE]:
         """Returns tree entries that contain FPDS record data"""
         data_entries = self.tree.findall(".//ns0:entry", self.namespace_dict)
         return data_entries
 
-    def get_entry_data(self):
-        entries = self.get_atom_feed_entries()
+    def _parse_entry(self, entry: TREE) -> Dict[str, str]:
+        """Flattens a single Atom entry into a record dictionary. Every leaf tag
+        is keyed by its name without the namespace, and its attributes are
+        keyed as `tag__attribute`
+
+        Example
+        -------
+        <ns1:contractActionType description="BPA" part8OrPart13="PART8">E</ns1:contractActionType>
+
+        Extracting the text value from `contractActionType` would return "E".
+        Addtional metadata is stored as tag attributes which this method will
+        help parse out. In this example, `contractActionType` has two
+        attributes: `description` and `part8OrPart13`. This method will
+        represent this tag the following way:
 
-        parsed_records = []
+            {
+                "contractActionType": "E",
+                "contractActionType__description": "BPA"
+                "contractActionType__part8OrPart13": "PART8"
+            }
+        """
+        entry_tags = dict()  # type: Dict[str, str]
+        # a tag is an individual data item; unresolved entities, comments
+        # and processing instructions are skipped
+        for tag in entry.iter(etree.Element):
+            if len(tag):
+                continue
+            local = tag.tag.rpartition("}")[2]
+            if tag.text:
+                entry_tags[local] = tag.text
+            for key, value in tag.attrib.items():
+                entry_tags[f"{local}__{key}"] = value
+        return entry_tags
+
+    def iter_entries(self) -> Iterator[Dict[str, str]]:
+        """Yields a record dictionary for every Atom entry in the response.
+
+        Bytes content is streamed with `lxml.etree.iterparse` so that only a
+        single entry is held in memory at a time; each entry is cleared, along
+        with its already processed siblings, once it has been parsed. If the
+        full tree has already been parsed (e.g. for pagination), it is walked
+        instead of parsing the bytes a second time.
+        """
+        if self.content is None or "tree" in self.__dict__:
+            for entry in self.get_atom_feed_entries():
+                yield self._parse_entry(entry)
+            return
+
+        events = etree.iterparse(
+            BytesIO(self.content),
+            events=("end",),
+            tag=f"{{{ATOM_NAMESPACE}}}entry",
+            collect_ids=False,
+            resolve_entities=False,
+            no_network=True,
+            load_dtd=False,
+        )
         # an entry is the XML tag that contains individual responses
-        for entry in entries:
-            entry_tags = dict()
-            tags = self.parse_items(entry)
-            # a tag is an individual data item
-            for tag in tags:
-                if not len(tag):
-                    elem = _ElementAttributes(tag, self.namespace_dict)
-                    entry_tags.update(elem._generate_nested_attribute_dict())
-            parsed_records.append(entry_tags)
-
-        return parsed_records
+        for _, elem in events:
+            yield self._parse_entry(elem)
+            elem.clear(keep_tail=True)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]  # type: ignore
+
+    def get_entry_data(self) -> Iterator[Dict[str, str]]:
+        """Returns an iterator of records parsed from the response entries.
+        See `iter_entries`
+        """
+        return self.iter_entries()
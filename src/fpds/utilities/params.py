@@ -28,14 +28,22 @@ def filter_config_dict(
     return field_dict
 
 
-def raw_literal_regex_match(pattern, string):
-    """Converts a regex pattern into a raw literal string to be used by
+def raw_literal_regex_compile(pattern):
+    """Converts a regex pattern into a raw literal string and compiles it with
     Python's regex module.
 
     This function was written out of a need of escaping single backslahes
     with double backslahes in JSON. See `constants/fields.json` for examples
     """
     raw_pattern = rf"{pattern}".replace("\\\\", "\\")
-    LITERAL_PATTERN = re.compile(raw_pattern)
+    return re.compile(raw_pattern)
+
+
+def raw_literal_regex_match(pattern, string):
+    """Converts a regex pattern into a raw literal string to be used by
+    Python's regex module and matches it against `string`. See
+    `raw_literal_regex_compile`
+    """
+    LITERAL_PATTERN = raw_literal_regex_compile(pattern)
     match = LITERAL_PATTERN.match(string)
     return match
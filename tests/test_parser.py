@@ -1,11 +1,10 @@
 import pytest
 import unittest
 from unittest import TestCase, mock
-from xml.etree import ElementTree
 
-import requests
+from lxml import etree
 
-from fpds import fpdsRequest
+from fpds import clear_cache, fpdsRequest, fpdsXML
 from tests import FULL_RESPONSE_DATA_BYTES
 
 # valid params and values
@@ -23,7 +22,7 @@ FPDS_REQUEST_INVALID_REGEX_DICT = {
     "LAST_MOD_DATE": "[2022/01/01, 2022/05/01]",
     "AGENCY_CODE": "not-a-proper-regex",
 }
-CONTENT_TREE = ElementTree.fromstring(FULL_RESPONSE_DATA_BYTES)
+CONTENT_TREE = etree.fromstring(FULL_RESPONSE_DATA_BYTES)
 
 
 class MockResponse(object):
@@ -40,6 +39,8 @@ class MockResponse(object):
 
 
 class MockFpdsXML(object):
+    content = FULL_RESPONSE_DATA_BYTES
+
     def pagination_links(self, params="some-param1: param1-value"):
         return [
             "{some-fpds-link}&start=0",
@@ -51,6 +52,7 @@ class MockFpdsXML(object):
 class TestFpdsRequest(TestCase):
     def setUp(self):
         self._class = fpdsRequest(**FPDS_REQUEST_PARAMS_DICT)
+        clear_cache()
 
     def test_params_exist(self):
         with pytest.raises(ValueError):
@@ -70,11 +72,46 @@ class TestFpdsRequest(TestCase):
         )
         self.assertEqual(self._class.__str__(), object_as_string)
 
-    @mock.patch.object(requests, "get")
+    @mock.patch("fpds.core.parser._SESSION.get")
     def test_send_request(self, mock_response):
+        mock_response.return_value = MockResponse(status_code=200)
+        content = self._class.send_request()
+        self.assertEqual(content, FULL_RESPONSE_DATA_BYTES)
+
+    @mock.patch("fpds.core.parser._SESSION.get")
+    def test_send_request_is_cached(self, mock_response):
         mock_response.return_value = MockResponse(status_code=200)
         self._class.send_request()
-        self.assertIn("content", self._class.__dict__)
+        self._class.send_request()
+        self.assertEqual(mock_response.call_count, 1)
+
+        # cleared cache entries are downloaded again
+        clear_cache()
+        self._class.send_request()
+        self.assertEqual(mock_response.call_count, 2)
+
+    @mock.patch("fpds.core.parser._SESSION.get")
+    def test_send_request_without_cache(self, mock_response):
+        mock_response.return_value = MockResponse(status_code=200)
+        request = fpdsRequest(cache=False, **FPDS_REQUEST_PARAMS_DICT)
+        request.send_request()
+        request.send_request()
+        self.assertEqual(mock_response.call_count, 2)
+
+    @mock.patch.object(fpdsRequest, "send_request")
+    @mock.patch("fpds.core.parser.fpdsXML")
+    def test_create_content_iterable_page_order(self, mock_xml, mock_response):
+        mock_xml.return_value = MockFpdsXML()
+        mock_response.side_effect = lambda url=None: url
+        self._class.create_content_iterable()
+        self.assertEqual(
+            self._class.content,
+            [
+                FULL_RESPONSE_DATA_BYTES,
+                "{some-fpds-link}&start=10",
+                "{some-fpds-link}&start=20",
+            ],
+        )
 
     @mock.patch.object(fpdsRequest, "send_request")
     @mock.patch("fpds.core.parser.fpdsXML")
@@ -85,14 +122,22 @@ class TestFpdsRequest(TestCase):
         self._class.create_content_iterable()
         self.assertEqual(mock_response.call_count, 3)
 
-    def side_effect_create_content_iterable(self):
-        self._class.content.append(CONTENT_TREE)
-
-    @mock.patch.object(fpdsRequest, "create_content_iterable")
+    @mock.patch.object(fpdsRequest, "_send_initial_request")
     def test_parse_content(self, mock_content):
-        mock_content.side_effect = self.side_effect_create_content_iterable()
-        records = self._class.parse_content()
+        mock_content.return_value = (fpdsXML(CONTENT_TREE), [])
+        records = list(self._class.parse_content())
         self.assertEqual(len(records), 10)
+        # pages aren't retained while streaming records
+        self.assertEqual(self._class.content, [])
+
+    @mock.patch("fpds.core.parser._SESSION.get")
+    def test_call(self, mock_response):
+        # every page returns the full response, which paginates to 3 pages
+        mock_response.return_value = MockResponse(status_code=200)
+        records = self._class()
+        self.assertEqual(mock_response.call_count, 3)
+        self.assertEqual(len(records), 30)
+        self.assertEqual(self._class.content, [])
 
 
 if __name__ == "__main__":
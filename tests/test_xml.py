@@ -1,6 +1,8 @@
 import pytest
-from unittest import TestCase
-from xml.etree.ElementTree import Element
+from unittest import TestCase, mock
+
+from lxml import etree
+from lxml.etree import _Element
 
 from fpds import fpdsXML
 from tests import FULL_RESPONSE_DATA_BYTES, TRUNCATED_RESPONSE_DATA_BYTES
@@ -25,7 +27,7 @@ class TestFpdsXML(TestCase):
 
     def test_convert_to_lxml_tree(self):
         content = self._class.convert_to_lxml_tree()
-        self.assertIsInstance(content, Element)
+        self.assertIsInstance(content, _Element)
 
     def test_response_size(self):
         self.assertEqual(self._class.response_size, 10)
@@ -33,6 +35,25 @@ class TestFpdsXML(TestCase):
     def test_namespace_dict(self):
         namespace_dict = self._class.namespace_dict
         self.assertEqual(namespace_dict, TEST_NAMESPACE_DICT)
+        # computed once per document
+        self.assertIs(self._class.namespace_dict, namespace_dict)
+
+    def test_namespace_dict_declaration_order(self):
+        """The root element's namespace is `ns0` even when it isn't the first
+        namespace declared on the root
+        """
+        content = FULL_RESPONSE_DATA_BYTES.replace(
+            b'xmlns:ns0="http://www.w3.org/2005/Atom" '
+            b'xmlns:ns1="https://www.fpds.gov/FPDS"',
+            b'xmlns:ns1="https://www.fpds.gov/FPDS" '
+            b'xmlns:ns0="http://www.w3.org/2005/Atom"',
+            1,
+        )
+        self.assertNotEqual(content, FULL_RESPONSE_DATA_BYTES)
+        _class = fpdsXML(content)
+        self.assertEqual(_class.namespace_dict, TEST_NAMESPACE_DICT)
+        self.assertEqual(_class.total_record_count, 20)
+        self.assertEqual(len(_class.get_atom_feed_entries()), 10)
 
     def test_total_record_count(self):
         total = self._class.total_record_count
@@ -50,6 +71,8 @@ class TestFpdsXML(TestCase):
     def test_pagination_links(self):
         links = self._class.pagination_links(params="some-param1: param1-value")
         self.assertEqual(len(links), 3)
+        # search parameters are URL-encoded
+        self.assertTrue(links[-1].endswith("&q=some-param1%3A+param1-value&start=20"))
 
     def test_get_atom_feed_entries(self):
         entries = self._class.get_atom_feed_entries()
@@ -57,3 +80,74 @@ class TestFpdsXML(TestCase):
         entry_types = set([type(entry) for entry in entries])
         self.assertEqual(len(entries), 10)
         self.assertEqual(len(entry_types), 1)
+
+    def test_entities_are_not_resolved(self):
+        content = (
+            b'<!DOCTYPE feed [<!ENTITY injected "injected-value">]>'
+            b'<ns0:feed xmlns:ns0="http://www.w3.org/2005/Atom">'
+            b"<ns0:entry><ns0:title>&injected;</ns0:title></ns0:entry>"
+            b"</ns0:feed>"
+        )
+        _class = fpdsXML(content)
+        self.assertNotIn(b"injected-value", etree.tostring(_class.tree))
+        records = list(_class.iter_entries())
+        self.assertNotIn("injected-value", records[0].values())
+
+    def test_iter_entries_nested_non_atom_entry(self):
+        """Only Atom entries are records; an `entry` tag in another namespace
+        is a data item of the record it is nested in
+        """
+        content = (
+            b'<feed xmlns="http://www.w3.org/2005/Atom" xmlns:f="urn:f">'
+            b"<entry><content><f:entry>1</f:entry><f:PIID>2</f:PIID></content>"
+            b"</entry></feed>"
+        )
+        records = list(fpdsXML(content).iter_entries())
+        self.assertEqual(records, [{"entry": "1", "PIID": "2"}])
+        tree = fpdsXML(content).tree
+        self.assertEqual(records, list(fpdsXML(tree).iter_entries()))
+
+    def test_iter_entries_nested_attributes(self):
+        content = (
+            b'<ns0:feed xmlns:ns0="http://www.w3.org/2005/Atom" '
+            b'xmlns:ns1="https://www.fpds.gov/FPDS"><ns0:entry><ns0:content>'
+            b'<ns1:contractActionType description="BPA" part8OrPart13="PART8">'
+            b"E</ns1:contractActionType><ns1:modNumber/></ns0:content>"
+            b"</ns0:entry></ns0:feed>"
+        )
+        expected = {
+            "contractActionType": "E",
+            "contractActionType__description": "BPA",
+            "contractActionType__part8OrPart13": "PART8",
+        }
+        records = list(fpdsXML(content).iter_entries())
+        self.assertEqual(records, [expected])
+        self.assertEqual(list(records[0]), list(expected))
+
+    def test_iter_entries_special_character_namespaces(self):
+        """Namespaces are stripped from record keys even when the namespace
+        URI contains regex-special characters
+        """
+        content = (
+            b'<ns0:feed xmlns:ns0="http://www.w3.org/2005/Atom" '
+            b'xmlns:a="http://a.b/c?d=(e)"><ns0:entry>'
+            b'<a:PIID type="x">1</a:PIID><modNumber>2</modNumber>'
+            b"</ns0:entry></ns0:feed>"
+        )
+        expected = [{"PIID": "1", "PIID__type": "x", "modNumber": "2"}]
+        self.assertEqual(list(fpdsXML(content).iter_entries()), expected)
+        tree = fpdsXML(content).tree
+        self.assertEqual(list(fpdsXML(tree).iter_entries()), expected)
+
+    def test_iter_entries_reuses_parsed_tree(self):
+        records = list(self._class.iter_entries())
+        # once the full tree has been parsed, it is walked instead
+        self._class.tree
+        with mock.patch.object(etree, "iterparse") as mock_iterparse:
+            self.assertEqual(list(self._class.iter_entries()), records)
+        mock_iterparse.assert_not_called()
+
+    def test_iter_entries(self):
+        records = list(self._class.iter_entries())
+        self.assertEqual(len(records), 10)
+        self.assertEqual(records, list(fpdsXML(self._class.tree).get_entry_data()))